@@ -10,24 +10,28 @@
 import os
 import re
 import csv
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 from datetime import datetime
-from typing import List, Tuple, Optional
+from itertools import islice
+from typing import Iterator, List, Tuple, Optional
 
 try:
     import pdfplumber
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.layout import LTChar, LTContainer
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
 except Exception as e:
     raise SystemExit("This script requires 'pdfplumber'. Install it with: pip install pdfplumber") from e
 
-PRICE_KG_RE = re.compile(
-    r"""^\s*(?P<weight>\d+(?:[.,]\d+)?)\s*kg\s*x\s*(?P<price>\d+(?:[.,]\d+)?)\s*€\s*/\s*kg\s*$""",
-    re.IGNORECASE
-)
-
-# Exemple : "5.5% CHISTORRA REFLETS 1 x 4.70 4.70"
-PRODUCT_RE = re.compile(
-    r"""^\s*(?:(?:\d{1,2}(?:[.,]\d)?|[0-9]{1,2})\s*%|\d{1,2}\.\d{1,2}\s*%)?\s*(?P<name>.+?)\s+(?P<qty>\d+)\s*x\s*(?P<unit>\d+(?:[.,]\d{1,2})?)\s+(?P<amount>-?\d+(?:[.,]\d{1,2})?)\s*$""",
-    re.IGNORECASE
-)
+# Cache disque des lignes extraites de chaque PDF (clé : chemin, taille, date de modification).
+# CACHE_VERSION est à incrémenter dès que l'extraction ou le parsing change de résultat.
+CACHE_VERSION = 4
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "carrefour-parser")
 
 # Lignes à ignorer
 SKIP_PREFIXES = (
@@ -44,26 +48,40 @@ SKIP_PREFIXES = (
     "carte bancaire",
 )
 
-# Recherche de date
-DATE_RES = [
-    re.compile(r"(?P<d>\d{2})/(?P<m>\d{2})/(?P<y>\d{4})\s*(?:à\s*)?(?P<h>\d{1,2})[h:](?P<min>\d{2})"),
-    re.compile(r"(?P<d>\d{2})[.](?P<m>\d{2})[.](?P<y>\d{2,4})\s+(?P<h>\d{1,2})[:](?P<min>\d{2})"),
-]
+# Une seule regex par ligne, trois alternatives testées dans l'ordre :
+#   kg   : "0,560 kg x 12,90 €/kg" (prix au kilo, associé au produit suivant)
+#   skip : ligne commençant par un des SKIP_PREFIXES
+#   prod : "5.5% CHISTORRA REFLETS 1 x 4.70 4.70"
+# Le module standard 're' est conservé : sur ces lignes courtes, google-re2 est
+# ~10x plus lent (coût du binding Python par appel, groupes nommés ou non).
+LINE_RE = re.compile(
+    r"^\s*(?:"
+    r"(?P<kg>(?P<weight>\d+(?:[.,]\d+)?)\s*kg\s*x\s*(?P<price>\d+(?:[.,]\d+)?)\s*€\s*/\s*kg\s*$)"
+    r"|(?P<skip>" + "|".join(re.escape(prefix) for prefix in SKIP_PREFIXES) + r")"
+    r"|(?P<prod>(?:(?:\d{1,2}(?:[.,]\d)?|[0-9]{1,2})\s*%|\d{1,2}\.\d{1,2}\s*%)?\s*(?P<name>.+?)\s+(?P<qty>\d+)\s*x\s*(?P<unit>\d+(?:[.,]\d{1,2})?)\s+(?P<amount>-?\d+(?:[.,]\d{1,2})?)\s*$)"
+    r")",
+    re.IGNORECASE
+)
+
+# Nettoyage des noms de produits
+_LEAD_PCT_RE = re.compile(r"^\s*\d{1,2}(?:[.,]\d{1,2})?\s*%\s*")
+_MULTISPACE_RE = re.compile(r"\s{2,}")
 
-def normalize_decimal(s: str) -> str:
-    return s.replace(",", ".")
+# Recherche de date
+# "12/03/2025 à 14h30", "12.03.25 14:30"... : la date est dans l'en-tête de la première page
+DATE_RE = re.compile(r"(?P<d>\d{2})[/.](?P<m>\d{2})[/.](?P<y>\d{4}|\d{2})\s*(?:à\s*)?(?P<h>\d{1,2})[h:](?P<min>\d{2})")
+DATE_SCAN_LIMIT = 2048
 
 def find_date(all_text: str) -> Optional[str]:
-    for rx in DATE_RES:
-        m = rx.search(all_text)
-        if m:
-            d, mth, y = int(m.group("d")), int(m.group("m")), int(m.group("y"))
-            if y < 100:  # '25' -> 2025
-                y += 2000
-            h, minute = int(m.group("h")), int(m.group("min"))
-            dt = datetime(y, mth, d, h, minute)
-            return dt.strftime("%d/%m/%Y")
-    return None
+    m = DATE_RE.search(all_text, 0, DATE_SCAN_LIMIT)
+    if not m:
+        return None
+    d, mth, y = int(m.group("d")), int(m.group("m")), int(m.group("y"))
+    if y < 100:  # '25' -> 2025
+        y += 2000
+    h, minute = int(m.group("h")), int(m.group("min"))
+    dt = datetime(y, mth, d, h, minute)
+    return dt.strftime("%d/%m/%Y")
 
 def parse_lines_to_rows(lines: List[str], invoice_date: Optional[str]) -> List[Tuple[str, str, str, str, str, str]]:
     """
@@ -74,34 +92,41 @@ def parse_lines_to_rows(lines: List[str], invoice_date: Optional[str]) -> List[T
     pending_pricekg: List[str] = []
 
     for raw in lines:
+        # Les lignes prix/kg et produit contiennent toutes un "x" (QTE x P.U, kg x prix) :
+        # sans lui, la ligne est forcément ignorée, inutile d'appeler la regex.
+        if "x" not in raw and "X" not in raw:
+            continue
+
         line = raw.strip()
         if not line:
             continue
 
-        # Détecte les prix/kg
-        mkg = PRICE_KG_RE.match(line)
-        if mkg:
-            weight = normalize_decimal(mkg.group("weight"))
-            price = normalize_decimal(mkg.group("price"))
-            pricekg_str = f"{weight}kg x {price}€/kg"
-            pending_pricekg.append(pricekg_str)
+        m = LINE_RE.match(line)
+        if not m:
             continue
+        kind = m.lastgroup
 
-        # Ignore les lignes inutiles
-        line_lower = line.lower()
-        if any(line_lower.startswith(prefix) for prefix in SKIP_PREFIXES):
+        # Prix/kg
+        if kind == "kg":
+            weight, price = m.group("weight", "price")
+            # Virgule décimale -> point, sans appel de fonction : str.replace est plus
+            # rapide que str.translate sur ces nombres courts (~50 ns contre ~330 ns)
+            weight = weight.replace(",", ".")
+            price = price.replace(",", ".")
+            pricekg_str = f"{weight}kg x {price}€/kg"
+            pending_pricekg.append(pricekg_str)
             continue
 
-        # Détecte les produits
-        mp = PRODUCT_RE.match(line)
-        if mp:
-            name = mp.group("name").strip()
-            name = re.sub(r"^\s*\d{1,2}(?:[.,]\d{1,2})?\s*%\s*", "", name).strip()
-            name = re.sub(r"\s{2,}", " ", name)
+        # Produits (les lignes "skip" sont ignorées)
+        if kind == "prod":
+            name, qty, unit, amount = m.group("name", "qty", "unit", "amount")
+            name = name.strip()
+            name = _LEAD_PCT_RE.sub("", name).strip()
+            name = _MULTISPACE_RE.sub(" ", name)
 
-            qty = mp.group("qty")
-            unit = normalize_decimal(mp.group("unit"))
-            amount = normalize_decimal(mp.group("amount"))
+            # Virgule décimale -> point (voir Prix/kg)
+            unit = unit.replace(",", ".")
+            amount = amount.replace(",", ".")
 
             qte_pu = f"{qty} x {unit}"
             pricekg = pending_pricekg.pop(0) if pending_pricekg else ""
@@ -114,51 +139,211 @@ def parse_lines_to_rows(lines: List[str], invoice_date: Optional[str]) -> List[T
 
     return out
 
-def extract_pdf_to_rows(pdf_path: str) -> List[Tuple[str, str, str, str, str, str]]:
-    import pdfplumber
+def _collate_chars(chars: List[Tuple[float, float, float, str]], x_tolerance: float = 3, y_tolerance: float = 3) -> str:
+    """
+    Regroupe des caractères (top, x0, x1, texte) en lignes de texte, comme
+    pdfplumber.extract_text_simple : lignes par 'top' à y_tolerance près,
+    un espace entre deux caractères séparés de plus de x_tolerance.
+    """
+    chars.sort()
+    out_lines = []
+    line: List[Tuple[float, float, float, str]] = []
+    last_top = None
+    for c in chars:
+        if last_top is not None and c[0] > last_top + y_tolerance:
+            out_lines.append(line)
+            line = []
+        line.append(c)
+        last_top = c[0]
+    if line:
+        out_lines.append(line)
+
+    texts = []
+    for line in out_lines:
+        parts = []
+        last_x1 = None
+        for _, x0, x1, text in sorted(line, key=lambda c: c[1]):
+            if last_x1 is not None and x0 > last_x1 + x_tolerance:
+                parts.append(" ")
+            parts.append(text)
+            last_x1 = x1
+        texts.append("".join(parts))
+    return "\n".join(texts)
+
+def _iter_page_texts_pdfminer(pdf_path: str) -> Iterator[str]:
+    """
+    Texte de chaque page, directement depuis pdfminer : pages interprétées sans
+    analyse de mise en page (laparams=None, comme pdfplumber) et sans construire
+    le dict de propriétés que pdfplumber crée pour chaque caractère.
+    """
+    with open(pdf_path, "rb") as fp:
+        rsrcmgr = PDFResourceManager()
+        device = PDFPageAggregator(rsrcmgr, laparams=None)
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        for page in PDFPage.get_pages(fp):
+            try:
+                interpreter.process_page(page)
+                chars = []
+                stack = [device.get_result()]
+                while stack:
+                    for obj in stack.pop():
+                        if isinstance(obj, LTChar):
+                            chars.append((-obj.y1, obj.x0, obj.x1, obj.get_text()))
+                        elif isinstance(obj, LTContainer):
+                            stack.append(obj)
+                yield _collate_chars(chars)
+            except Exception:
+                yield ""
+
+def _iter_page_texts_pdfplumber(pdf_path: str) -> Iterator[str]:
     with pdfplumber.open(pdf_path) as pdf:
-        page_texts = []
         for page in pdf.pages:
             try:
-                txt = page.extract_text() or ""
+                if hasattr(page, "extract_text_simple"):
+                    yield page.extract_text_simple(x_tolerance=3, y_tolerance=3) or ""
+                else:
+                    yield page.extract_text(layout=False, x_tolerance=3, y_tolerance=3) or ""
             except Exception:
-                txt = ""
-            page_texts.append(txt)
-        all_text = "\n".join(page_texts)
+                yield ""
+
+def _read_page_texts(page_texts: Iterator[str]) -> Tuple[List[str], str]:
+    """
+    Retourne (lignes de tout le document, texte de la première page).
+    """
+    lines: List[str] = []
+    first_page_text: Optional[str] = None
+    for txt in page_texts:
+        lines.extend(txt.split("\n"))
+        # La date figure dans l'en-tête : inutile de chercher dans tout le document
+        if first_page_text is None:
+            first_page_text = txt
+    return lines, first_page_text or ""
 
-    inv_date = find_date(all_text)
-    lines = all_text.split("\n")
+def extract_pdf_to_rows(pdf_path: str) -> List[Tuple[str, str, str, str, str, str]]:
+    lines, header_text = _read_page_texts(_iter_page_texts_pdfminer(pdf_path))
+    if not any(lines):
+        # Aucun texte via pdfminer : nouvel essai avec pdfplumber
+        lines, header_text = _read_page_texts(_iter_page_texts_pdfplumber(pdf_path))
+
+    inv_date = find_date(header_text)
     return parse_lines_to_rows(lines, inv_date)
 
-def extract_invoices_to_csv(input_path: str, output_csv: str) -> None:
+def _extract_pdf_safe(pdf_path: str) -> Optional[List[Tuple[str, str, str, str, str, str]]]:
+    """
+    Comme extract_pdf_to_rows, mais retourne None en cas d'échec
+    (un PDF invalide ne doit pas interrompre tout le lot).
+    """
+    try:
+        return extract_pdf_to_rows(pdf_path)
+    except Exception as e:
+        print(f"[WARN] Failed to parse {pdf_path}: {e}")
+        return None
+
+def _cache_file(pdf_path: str) -> str:
+    try:
+        st = os.stat(pdf_path)
+    except OSError:
+        # PDF disparu ou illisible : pas de cache, l'extraction le signalera et l'ignorera
+        return ""
+    key = f"{CACHE_VERSION}:{st.st_size}:{st.st_mtime_ns}:{os.path.abspath(pdf_path)}"
+    return os.path.join(CACHE_DIR, hashlib.blake2b(key.encode("utf-8")).hexdigest() + ".json")
+
+def _load_cached_rows(cache_file: str) -> Optional[List[Tuple[str, str, str, str, str, str]]]:
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return [tuple(row) for row in json.load(f)]
+    except (OSError, ValueError):
+        return None
+
+def _store_cached_rows(cache_file: str, rows: List[Tuple[str, str, str, str, str, str]]) -> None:
+    # Le cache est facultatif : une erreur d'écriture n'empêche pas l'extraction
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = cache_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        print(f"[WARN] Failed to write cache {cache_file}: {e}")
+
+def _parse_pdfs(pdf_paths: List[str]) -> Iterator[Optional[List[Tuple[str, str, str, str, str, str]]]]:
+    """
+    Extrait les lignes de chaque PDF, renvoyées au fur et à mesure dans l'ordre de pdf_paths.
+    """
+    if len(pdf_paths) <= 1:
+        # Un seul fichier : pas de pool, évite le coût de démarrage des processus
+        yield from map(_extract_pdf_safe, pdf_paths)
+        return
+    # Chaque PDF est indépendant : extraction en parallèle, résultats dans l'ordre.
+    # Fenêtre glissante de 2 tâches par processus : contrairement à Executor.map, qui
+    # soumet tout d'un coup, un PDF lent ne fait pas accumuler le reste de l'archive en mémoire.
+    workers = os.cpu_count() or 1
+    pending = iter(pdf_paths)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        window = deque(ex.submit(_extract_pdf_safe, p) for p in islice(pending, 2 * workers))
+        while window:
+            result = window.popleft().result()
+            for p in islice(pending, 1):
+                window.append(ex.submit(_extract_pdf_safe, p))
+            yield result
+
+def _iter_pdfs(root: str) -> Iterator[str]:
+    """
+    Parcourt récursivement root et renvoie les chemins des .pdf.
+    Utilise os.scandir : le type de chaque entrée vient du DirEntry, sans stat() supplémentaire.
+    """
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            # Dossier illisible : ignoré, comme le faisait os.walk
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(".pdf") and entry.is_file():
+                    yield entry.path
+
+def extract_invoices_to_csv(input_path: str, output_csv: str, use_cache: bool = True) -> None:
     paths: List[str] = []
 
     if os.path.isdir(input_path):
-        for root, _, files in os.walk(input_path):
-            for fn in files:
-                if fn.lower().endswith(".pdf"):
-                    paths.append(os.path.join(root, fn))
+        paths.extend(_iter_pdfs(input_path))
     elif os.path.isfile(input_path) and input_path.lower().endswith(".pdf"):
         paths.append(input_path)
     else:
         raise SystemExit("Provide a PDF file or a directory containing PDFs.")
 
-    rows: List[Tuple[str, str, str, str, str, str]] = []
-    for p in sorted(paths):
-        try:
-            rows.extend(extract_pdf_to_rows(p))
-        except Exception as e:
-            print(f"[WARN] Failed to parse {p}: {e}")
+    paths.sort()
+
+    # Les PDF inchangés depuis le dernier passage sont lus depuis le cache,
+    # les autres sont extraits (en parallèle) pendant l'écriture du CSV
+    cache_files = [_cache_file(p) if use_cache else "" for p in paths]
+    cached = [bool(cache_file) and os.path.isfile(cache_file) for cache_file in cache_files]
+    todo = [p for p, hit in zip(paths, cached) if not hit]
 
-    with open(output_csv, "w", newline="", encoding="utf-8") as f:
+    # Les lignes de chaque facture sont écrites dès qu'elles sont disponibles
+    with closing(_parse_pdfs(todo)) as parsed, open(output_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["name", "type", "price-kg", "QTE x P.U", "amount", "date"])
-        writer.writerows(rows)
+        for p, cache_file, hit in zip(paths, cache_files, cached):
+            rows = _load_cached_rows(cache_file) if hit else None
+            if rows is None:
+                # Entrée de cache illisible : extraction directe
+                rows = _extract_pdf_safe(p) if hit else next(parsed)
+                if rows is None:
+                    continue
+                if cache_file:
+                    _store_cached_rows(cache_file, rows)
+            writer.writerows(rows)
 
 if __name__ == "__main__":
     import argparse
     ap = argparse.ArgumentParser(description="Extract invoice lines from PDF(s) to CSV.")
     ap.add_argument("input", help="Path to a PDF file or a directory of PDFs")
     ap.add_argument("-o", "--output", default="invoices.csv", help="Output CSV path (default: invoices.csv)")
+    ap.add_argument("--no-cache", action="store_true", help=f"Ignore the extraction cache ({CACHE_DIR})")
     args = ap.parse_args()
-    extract_invoices_to_csv(args.input, args.output)
+    extract_invoices_to_csv(args.input, args.output, use_cache=not args.no_cache)
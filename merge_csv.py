@@ -5,26 +5,293 @@ import os
 import sys
 import glob
 import csv
+import re
+import mmap
+import codecs
+import shutil
 import argparse
-from typing import List, Tuple, Dict
+from typing import FrozenSet, List, Optional, Set, Tuple
 
-def _read_csv_dicts(path: str) -> Tuple[List[str], List[Dict[str, str]]]:
+# pyarrow (optionnel) : lecture, déduplication et tri des CSV en C++
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# Tampon d'écriture (1 Mo au lieu des 8 Ko par défaut) : moins d'appels write()
+_WRITE_BUFFER_SIZE = 1024 * 1024
+# Taille des blocs pour la lecture/copie binaire des fichiers
+_COPY_BUFFER_SIZE = 1024 * 1024
+# Quantificateurs possessifs (Python >= 3.11) : validation ~3x plus rapide, sans retour
+# arrière. Avant 3.11, "*" et "?" simples donnent le même résultat : les classes de
+# caractères d'un champ n'incluent ni "," ni les fins de ligne.
+_POSSESSIVE = b"+" if sys.version_info >= (3, 11) else b""
+
+def _detect_encoding(path: str) -> str:
     """
-    Lit un CSV en dicts, avec fallback d'encodage.
-    Retourne (header, rows).
+    Détermine l'encodage d'un CSV (utf-8, sinon latin-1) en le lisant par blocs,
+    sans le charger en mémoire. L'utf-8 est lu en "utf-8-sig" : un éventuel BOM
+    (ajouté par Excel) ne doit pas se retrouver dans le nom de la première colonne.
     """
-    last_err = None
-    for enc in ("utf-8", "latin-1"):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
         try:
-            with open(path, "r", encoding=enc, newline="") as f:
-                reader = csv.DictReader(f)
-                header = reader.fieldnames or []
-                rows = [row for row in reader]
-            return header, rows
-        except UnicodeDecodeError as e:
-            last_err = e
+            for chunk in iter(lambda: f.read(_COPY_BUFFER_SIZE), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "latin-1"
+    return "utf-8-sig"
+
+def _read_header_line(path: str) -> bytes:
+    """
+    Première ligne brute d'un CSV (fin de ligne comprise), sans BOM.
+    """
+    with open(path, "rb") as fin:
+        line = fin.readline()
+    return line[len(codecs.BOM_UTF8):] if line.startswith(codecs.BOM_UTF8) else line
+
+def _line_ending(line: bytes) -> Optional[bytes]:
+    """
+    Fin de ligne (b"\\r\\n" ou b"\\n") d'une ligne brute, None si elle n'en a pas.
+    """
+    if line.endswith(b"\r\n"):
+        return b"\r\n"
+    if line.endswith(b"\n"):
+        return b"\n"
+    return None
+
+def _plain_row(width: int) -> bytes:
+    """
+    Motif d'une ligne recopiable telle quelle : exactement width champs,
+    sans guillemet ni retour chariot (fin de ligne non comprise).
+    """
+    field = rb'[^,\r\n"]*' + _POSSESSIVE
+    return field + rb"(?:," + field + rb"){%d}" % (width - 1)
+
+def _plain_rows_re(width: int, eol: bytes) -> "re.Pattern[bytes]":
+    """
+    Regex reconnaissant un corps de CSV recopiable tel quel : lignes régulières
+    (voir _plain_row), toutes terminées par eol (sauf éventuellement la dernière).
+    """
+    row = _plain_row(width)
+    return re.compile(
+        rb"(?:" + row + re.escape(eol) + rb")*" + _POSSESSIVE + rb"(?:" + row + rb")?" + _POSSESSIVE
+    )
+
+def _has_plain_body(path: str, plain_rows: "re.Pattern[bytes]") -> bool:
+    """
+    Vrai si les lignes de données (tout sauf le header) correspondent à plain_rows.
+    Le fichier est parcouru via mmap, sans copie en mémoire.
+    """
+    with open(path, "rb") as fin:
+        fin.readline()
+        body_start = fin.tell()
+        if body_start >= os.fstat(fin.fileno()).st_size:
+            return True
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return plain_rows.fullmatch(mm, body_start) is not None
+
+def _plain_concat_eol(inputs: List[Tuple[str, str, List[str]]], first_header: List[str]) -> Optional[bytes]:
+    """
+    Détermine si les fichiers peuvent être simplement concaténés octet par octet :
+    tous en utf-8, colonnes dans le même ordre, lignes régulières (voir _plain_rows_re)
+    et même fin de ligne que le header du premier fichier.
+    Retourne cette fin de ligne, ou None s'il faut parser les lignes.
+    """
+    if not inputs or len(first_header) < 2:
+        return None
+    if any(encoding != "utf-8-sig" or header != first_header for _, encoding, header in inputs):
+        return None
+
+    eol = _line_ending(_read_header_line(inputs[0][0])) or b"\r\n"
+    plain_header = re.compile(_plain_row(len(first_header)))
+    plain_rows = _plain_rows_re(len(first_header), eol)
+    for p, _, _ in inputs:
+        header_line = _read_header_line(p)
+        ending = _line_ending(header_line)
+        if ending not in (eol, None):
+            return None
+        # readline() ne coupe que sur "\n" : un fichier aux fins de ligne "\r" seules
+        # serait lu comme un unique header, on le refuse avec la regex des lignes
+        if plain_header.fullmatch(header_line, 0, len(header_line) - len(ending or b"")) is None:
+            return None
+        if not _has_plain_body(p, plain_rows):
+            return None
+    return eol
+
+def _concat_plain(inputs: List[Tuple[str, str, List[str]]], output_csv: str, eol: bytes) -> None:
+    """
+    Concatène les fichiers octet par octet : header brut du premier fichier,
+    puis les lignes de données de chacun (voir _plain_concat_eol).
+    """
+    with open(output_csv, "wb", buffering=_WRITE_BUFFER_SIZE) as out:
+        header_line = _read_header_line(inputs[0][0])
+        if not header_line.endswith(b"\n"):
+            header_line += eol
+        out.write(header_line)
+        for p, _, _ in inputs:
+            with open(p, "rb") as fin:
+                fin.readline()
+                body_start = fin.tell()
+                shutil.copyfileobj(fin, out, _COPY_BUFFER_SIZE)
+                # Dernière ligne sans saut de ligne : on l'ajoute avant le fichier suivant
+                if fin.tell() > body_start:
+                    fin.seek(-1, os.SEEK_END)
+                    if fin.read(1) != b"\n":
+                        out.write(eol)
+
+def _read_header(path: str, encoding: str) -> List[str]:
+    """
+    Retourne la première ligne (header) d'un CSV, [] si le fichier est vide.
+    """
+    with open(path, "r", encoding=encoding, newline="") as f:
+        return next(csv.reader(f), [])
+
+def _scan_inputs(paths: List[str]) -> Tuple[List[str], List[Tuple[str, str, List[str]]]]:
+    """
+    Lit l'encodage et le header de chaque CSV et vérifie que les colonnes sont
+    identiques à celles du premier fichier. Les fichiers vides ou sans header sont ignorés.
+    Retourne (first_header, [(path, encoding, header), ...]).
+    """
+    first_header: List[str] = []
+    first_header_set: FrozenSet[str] = frozenset()
+    inputs: List[Tuple[str, str, List[str]]] = []
+
+    for p in paths:
+        encoding = _detect_encoding(p)
+        header = _read_header(p, encoding)
+        if not header:
+            # CSV vide ou sans header
             continue
-    raise last_err or RuntimeError(f"Impossible de lire le fichier: {path}")
+
+        if not first_header:
+            first_header = list(header)
+            first_header_set = frozenset(first_header)
+        elif frozenset(header) != first_header_set:
+            raise ValueError(
+                f"Les colonnes de '{os.path.basename(p)}' diffèrent de celles du premier fichier.\n"
+                f"Trouvé: {header}\nAttendu: {first_header}"
+            )
+        inputs.append((p, encoding, header))
+
+    return first_header, inputs
+
+def _merge_with_csv(
+    inputs: List[Tuple[str, str, List[str]]],
+    first_header: List[str],
+    output_csv: str,
+    dedupe: bool,
+    sort_by: str,
+) -> None:
+    """
+    Fusion avec le module csv, ligne par ligne (seul le tri garde les lignes en mémoire).
+    """
+    sorted_rows: List[List[str]] = []
+    seen: Set[Tuple[str, ...]] = set()
+
+    with open(output_csv, "w", encoding="utf-8", newline="", buffering=_WRITE_BUFFER_SIZE) as f:
+        writer = csv.writer(f)
+        writer.writerow(first_header)
+
+        for p, encoding, header in inputs:
+            # Position dans ce fichier de chaque colonne de first_header
+            # (calculée une fois par fichier ; inutile si l'ordre est déjà le bon)
+            col_map = [header.index(col) for col in first_header]
+            same_order = header == first_header
+            width = len(header)
+
+            # Lecture texte bufferisée : un découpage des lignes via mmap + find() a été mesuré
+            # ~50 % plus lent (boucle Python par ligne), sans gain non plus pour la copie ou
+            # la détection d'encodage, dominées par le disque et le décodage utf-8.
+            with open(p, "r", encoding=encoding, newline="") as fin:
+                reader = csv.reader(fin)
+                next(reader, None)
+                for r in reader:
+                    if not r:
+                        # Ligne vide
+                        continue
+                    if len(r) < width:
+                        r += [""] * (width - len(r))
+                    # Réordonner chaque ligne selon first_header
+                    # (les champs en trop sont ignorés, comme avec DictReader)
+                    row = r if same_order and len(r) == width else [r[i] for i in col_map]
+
+                    # Déduplication (préserve l'ordre)
+                    if dedupe:
+                        t = tuple(row)
+                        if t in seen:
+                            continue
+                        seen.add(t)
+
+                    if sort_by:
+                        sorted_rows.append(row)
+                    else:
+                        writer.writerow(row)
+
+        # Tri
+        if sort_by:
+            idx = first_header.index(sort_by)
+            sorted_rows.sort(key=lambda r: r[idx])
+            writer.writerows(sorted_rows)
+
+def _merge_with_arrow(
+    inputs: List[Tuple[str, str, List[str]]],
+    first_header: List[str],
+    dedupe: bool,
+    sort_by: str,
+) -> "pa.Table":
+    """
+    Fusion avec pyarrow : lecture, déduplication et tri sans boucle Python par ligne.
+    Toutes les colonnes sont lues comme du texte, pour ne pas altérer les valeurs.
+    Retourne la table fusionnée (l'écriture est faite par _write_arrow_table).
+    """
+    tables = []
+    for p, encoding, header in inputs:
+        table = pa_csv.read_csv(
+            p,
+            # pyarrow retire lui-même le BOM en utf-8
+            read_options=pa_csv.ReadOptions(encoding="utf8" if encoding == "utf-8-sig" else encoding),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={col: pa.string() for col in header},
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        # Réordonner les colonnes selon first_header
+        tables.append(table.select(first_header))
+
+    merged = pa.concat_tables(tables)
+
+    # Déduplication (préserve l'ordre) : on garde la première occurrence de chaque ligne
+    if dedupe:
+        row_col = "__merge_csv_row__"
+        merged = merged.append_column(row_col, pa.array(range(merged.num_rows), pa.int64()))
+        merged = (
+            merged.group_by(first_header)
+            .aggregate([(row_col, "min")])
+            .sort_by(f"{row_col}_min")
+            .select(first_header)
+        )
+
+    # Tri (stable, comme list.sort)
+    if sort_by:
+        merged = merged.sort_by(sort_by)
+
+    return merged
+
+def _write_arrow_table(table: "pa.Table", first_header: List[str], output_csv: str) -> None:
+    """
+    Ecrit une table pyarrow avec csv.writer, pour produire exactement le même format
+    (guillemets, fins de ligne) que le module csv.
+    """
+    with open(output_csv, "w", encoding="utf-8", newline="", buffering=_WRITE_BUFFER_SIZE) as f:
+        writer = csv.writer(f)
+        writer.writerow(first_header)
+        for batch in table.to_batches():
+            writer.writerows(zip(*(column.to_pylist() for column in batch.columns)))
 
 def merge_csv_folder(
     folder_path: str,
@@ -40,6 +307,12 @@ def merge_csv_folder(
     - Vérifie que l'ensemble des colonnes est identique pour tous les fichiers.
     - Optionnel: déduplication des lignes et tri par colonne.
 
+    Si tous les fichiers sont en utf-8 avec les colonnes dans le même ordre, des lignes
+    régulières et les mêmes fins de ligne (et sans déduplication ni tri), ils sont
+    simplement concaténés octet par octet. Sinon les lignes sont relues avec le module csv,
+    au fil de l'eau. La déduplication et le tri, qui gardent de toute façon les lignes
+    en mémoire, passent par pyarrow s'il est installé.
+
     Retourne le chemin absolu du CSV de sortie.
     """
     if not os.path.isdir(folder_path):
@@ -49,57 +322,40 @@ def merge_csv_folder(
     if not paths:
         raise FileNotFoundError(f"Aucun fichier ne correspond à '{pattern}' dans {folder_path}")
 
-    first_header: List[str] = []
-    merged_rows: List[List[str]] = []
-    total_files = 0
-    total_rows = 0
+    first_header, inputs = _scan_inputs(paths)
 
-    for p in paths:
-        header, rows_dicts = _read_csv_dicts(p)
-        if not header:
-            # CSV vide ou sans header
-            continue
+    if sort_by and sort_by not in first_header:
+        raise KeyError(f"La colonne '{sort_by}' n'existe pas dans les données: {first_header}")
 
-        if not first_header:
-            first_header = list(header)
-        else:
-            if set(header) != set(first_header):
-                raise ValueError(
-                    f"Les colonnes de '{os.path.basename(p)}' diffèrent de celles du premier fichier.\n"
-                    f"Trouvé: {header}\nAttendu: {first_header}"
-                )
+    plain_eol = None if dedupe or sort_by else _plain_concat_eol(inputs, first_header)
 
-        # Réordonner chaque ligne selon first_header
-        for rd in rows_dicts:
-            merged_rows.append([rd.get(col, "") for col in first_header])
-
-        total_files += 1
-        total_rows += len(rows_dicts)
-
-    # Déduplication (préserve l'ordre)
-    if dedupe:
-        seen = set()
-        unique_rows = []
-        for row in merged_rows:
-            t = tuple(row)
-            if t not in seen:
-                seen.add(t)
-                unique_rows.append(row)
-        merged_rows = unique_rows
-
-    # Tri
-    if sort_by:
-        if sort_by not in first_header:
-            raise KeyError(f"La colonne '{sort_by}' n'existe pas dans les données: {first_header}")
-        idx = first_header.index(sort_by)
-        merged_rows.sort(key=lambda r: r[idx])
-
-    # Ecriture
     os.makedirs(os.path.dirname(os.path.abspath(output_csv)) or ".", exist_ok=True)
-    with open(output_csv, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(first_header)
-        writer.writerows(merged_rows)
+    # Ecriture dans un fichier temporaire : la sortie n'est remplacée qu'en cas de succès
+    tmp_csv = output_csv + ".tmp"
+
+    try:
+        if plain_eol is not None:
+            _concat_plain(inputs, tmp_csv, plain_eol)
+        elif pa is not None and inputs and (dedupe or sort_by):
+            # pyarrow charge tous les fichiers : réservé à la déduplication et au tri
+            # (une lecture par blocs avec pa_csv.open_csv n'est pas plus rapide que le
+            # module csv pour une simple fusion, et consomme plus de mémoire)
+            try:
+                merged = _merge_with_arrow(inputs, first_header, dedupe, sort_by)
+            except Exception:
+                # Fichier que pyarrow refuse (ex: lignes incomplètes) : repli sur le module csv
+                merged = None
+            if merged is not None:
+                _write_arrow_table(merged, first_header, tmp_csv)
+            else:
+                _merge_with_csv(inputs, first_header, tmp_csv, dedupe, sort_by)
+        else:
+            _merge_with_csv(inputs, first_header, tmp_csv, dedupe, sort_by)
+        os.replace(tmp_csv, output_csv)
+    except BaseException:
+        if os.path.exists(tmp_csv):
+            os.remove(tmp_csv)
+        raise
 
     return os.path.abspath(output_csv)
 
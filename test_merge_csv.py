@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import merge_csv
+
+class _MergeCsvTestCase(unittest.TestCase):
+    """
+    Dossier temporaire d'entrée et CSV de sortie. Les sous-classes "CsvModule"
+    rejouent les mêmes cas sans pyarrow, pour tester les deux backends.
+    """
+
+    use_pyarrow = True
+
+    def setUp(self):
+        if self.use_pyarrow:
+            if merge_csv.pa is None:
+                self.skipTest("pyarrow n'est pas installé")
+        else:
+            patcher = mock.patch.object(merge_csv, "pa", None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.folder = os.path.join(self.tmp.name, "in")
+        os.makedirs(self.folder)
+        self.output = os.path.join(self.tmp.name, "out.csv")
+
+    def _write(self, name, data):
+        with open(os.path.join(self.folder, name), "wb") as f:
+            f.write(data)
+
+    def _read_output(self):
+        with open(self.output, "r", encoding="utf-8", newline="") as f:
+            return list(csv.reader(f))
+
+class MergeCsvBomTest(_MergeCsvTestCase):
+    """
+    Un CSV utf-8 avec BOM (tel qu'écrit par Excel) se fusionne comme un CSV sans BOM.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._write("a.csv", b"\xef\xbb\xbfname,amount\r\nfoo,1\r\nbar,2\r\n")
+        self._write("b.csv", b"amount,name\r\n3,baz\r\n2,bar\r\n")
+
+    def test_plain_merge(self):
+        merge_csv.merge_csv_folder(self.folder, self.output)
+        self.assertEqual(
+            self._read_output(),
+            [["name", "amount"], ["foo", "1"], ["bar", "2"], ["baz", "3"], ["bar", "2"]],
+        )
+
+    def test_dedupe(self):
+        merge_csv.merge_csv_folder(self.folder, self.output, dedupe=True)
+        self.assertEqual(
+            self._read_output(),
+            [["name", "amount"], ["foo", "1"], ["bar", "2"], ["baz", "3"]],
+        )
+
+    def test_sort_by(self):
+        merge_csv.merge_csv_folder(self.folder, self.output, sort_by="amount")
+        self.assertEqual(
+            self._read_output(),
+            [["name", "amount"], ["foo", "1"], ["bar", "2"], ["bar", "2"], ["baz", "3"]],
+        )
+
+    def test_sort_by_bom_column(self):
+        merge_csv.merge_csv_folder(self.folder, self.output, sort_by="name")
+        self.assertEqual(self._read_output()[0], ["name", "amount"])
+
+class MergeCsvBomCsvModuleTest(MergeCsvBomTest):
+    use_pyarrow = False
+
+class MergeCsvLineEndingTest(_MergeCsvTestCase):
+    """
+    La concaténation directe ne mélange pas les fins de ligne.
+    """
+
+    def _merge(self):
+        merge_csv.merge_csv_folder(self.folder, self.output)
+        with open(self.output, "rb") as f:
+            return f.read()
+
+    def test_lf_inputs_keep_lf(self):
+        self._write("a.csv", b"name,amount\nfoo,1\nbar,2")
+        self._write("b.csv", b"name,amount\nbaz,3\n")
+        self.assertEqual(self._merge(), b"name,amount\nfoo,1\nbar,2\nbaz,3\n")
+
+    def test_mixed_inputs_are_normalized(self):
+        self._write("a.csv", b"name,amount\nfoo,1\n")
+        self._write("b.csv", b"name,amount\r\nbaz,3\r\n")
+        self.assertEqual(self._merge(), b"name,amount\r\nfoo,1\r\nbaz,3\r\n")
+
+    def test_cr_only_input_is_parsed(self):
+        self._write("a.csv", b"name,amount\nfoo,1\n")
+        self._write("b.csv", b"name,amount\rbaz,3\rqux,4\r")
+        self.assertEqual(self._merge(), b"name,amount\r\nfoo,1\r\nbaz,3\r\nqux,4\r\n")
+
+    def test_cr_only_first_input_is_parsed(self):
+        self._write("a.csv", b"name,amount\rbaz,3\rqux,4\r")
+        self._write("b.csv", b"name,amount\nfoo,1\n")
+        self.assertEqual(self._merge(), b"name,amount\r\nbaz,3\r\nqux,4\r\nfoo,1\r\n")
+
+class MergeCsvLineEndingCsvModuleTest(MergeCsvLineEndingTest):
+    use_pyarrow = False
+
+class MergeCsvExtraFieldsTest(_MergeCsvTestCase):
+    """
+    Les champs en trop d'une ligne sont ignorés, y compris pour la déduplication.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._write("1.csv", b"name,amount\nfoo,1\nbar,2,EXTRA\nbar,2\n")
+
+    def test_extra_fields_dropped(self):
+        merge_csv.merge_csv_folder(self.folder, self.output)
+        self.assertEqual(
+            self._read_output(),
+            [["name", "amount"], ["foo", "1"], ["bar", "2"], ["bar", "2"]],
+        )
+
+    def test_extra_fields_dropped_with_dedupe(self):
+        merge_csv.merge_csv_folder(self.folder, self.output, dedupe=True)
+        self.assertEqual(self._read_output(), [["name", "amount"], ["foo", "1"], ["bar", "2"]])
+
+class MergeCsvExtraFieldsCsvModuleTest(MergeCsvExtraFieldsTest):
+    use_pyarrow = False
+
+if __name__ == "__main__":
+    unittest.main()